@@ -4,6 +4,9 @@ Generate a simple filled invoice as a PDF using reportlab.
 Run with: python3 generate_sample_invoice.py
 """
 
+import hashlib
+import os
+
 try:
     from reportlab.lib.pagesizes import letter
     from reportlab.lib import colors
@@ -23,10 +26,27 @@ except ImportError:
     from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
     from reportlab.lib.enums import TA_RIGHT, TA_CENTER
 
+def source_fingerprint():
+    """Hash of this script, embedded in the PDF title to detect stale output"""
+    with open(__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=8).hexdigest()
+
+def is_up_to_date(filename, title):
+    """Check whether an existing PDF was generated from the current script"""
+    if not os.path.exists(filename):
+        return False
+    with open(filename, 'rb') as f:
+        return title.encode('ascii') in f.read()
+
 def create_filled_invoice():
     """Create a filled invoice with realistic data"""
     filename = "sample_documents/filled-invoice.pdf"
-    doc = SimpleDocTemplate(filename, pagesize=letter)
+    title = f"invoice-{source_fingerprint()}"
+    if is_up_to_date(filename, title):
+        print(f"✅ Up-to-date: {filename}")
+        return
+    
+    doc = SimpleDocTemplate(filename, pagesize=letter, title=title)
     story = []
     styles = getSampleStyleSheet()
     
@@ -151,6 +171,5 @@ def create_filled_invoice():
     print("  - Payment terms and instructions")
 
 if __name__ == "__main__":
-    import os
     os.makedirs("sample_documents", exist_ok=True)
     create_filled_invoice()
@@ -2,25 +2,78 @@
 Document Processing Lambda Function
 Extracts data from documents using Amazon Textract
 """
-import json
+import hashlib
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, wait
 import boto3
+import orjson
+from botocore.config import Config
 from datetime import datetime
-from decimal import Decimal
-import traceback
 from utils.textract_parser import TextractParser
 from utils.dynamo_handler import DynamoDBHandler
 
-s3_client = boto3.client('s3')
-textract_client = boto3.client('textract')
-sns_client = boto3.client('sns')
+# Adaptive retries back off client-side under Textract/DynamoDB throttling,
+# and keep-alive lets warm invocations reuse the pooled HTTPS connections
+BOTO_CONFIG = Config(
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=3,
+    read_timeout=30,
+    max_pool_connections=50
+)
+
+s3_client = boto3.client('s3', config=BOTO_CONFIG)
+textract_client = boto3.client('textract', config=BOTO_CONFIG)
+sns_client = boto3.client('sns', config=BOTO_CONFIG)
 
 TABLE_NAME = os.environ.get('TABLE_NAME')
 SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
 BUCKET_NAME = os.environ.get('BUCKET_NAME')
+TEXTRACT_TOPIC_ARN = os.environ.get('TEXTRACT_TOPIC_ARN')
+TEXTRACT_ROLE_ARN = os.environ.get('TEXTRACT_ROLE_ARN')
+COMPRESS_EXTRACTED_DATA = os.environ.get('COMPRESS_EXTRACTED_DATA', 'true').lower() == 'true'
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+# Full event and result dumps are only built when debugging
+_DEBUG = logger.isEnabledFor(logging.DEBUG)
+
+# File types Textract AnalyzeDocument can read
+SUPPORTED_EXTENSIONS = frozenset({'pdf', 'png', 'jpg', 'jpeg', 'tiff', 'tif'})
 
 parser = TextractParser()
-db_handler = DynamoDBHandler(TABLE_NAME)
+db_handler = DynamoDBHandler(
+    TABLE_NAME,
+    config=BOTO_CONFIG,
+    compress_extracted_data=COMPRESS_EXTRACTED_DATA
+)
+
+
+def _prime_clients():
+    """
+    Build botocore's operation models for every API call the handlers make.
+    
+    botocore loads these lazily on first use; doing it during init means
+    the work is captured in the SnapStart snapshot instead of being repeated
+    by the first invocation after each restore.
+    """
+    operations = (
+        (s3_client, ('CopyObject', 'DeleteObject')),
+        (textract_client, ('AnalyzeDocument', 'StartDocumentAnalysis', 'GetDocumentAnalysis')),
+        (sns_client, ('Publish',)),
+        (db_handler.client, ('PutItem', 'UpdateItem', 'GetItem', 'Query', 'BatchWriteItem')),
+    )
+    for client, operation_names in operations:
+        for operation_name in operation_names:
+            client.meta.service_model.operation_model(operation_name)
+
+
+_prime_clients()
+
+# Created at init so the worker threads survive across warm invocations
+_executor = ThreadPoolExecutor(max_workers=4)
 
 
 def lambda_handler(event, context):
@@ -34,7 +87,8 @@ def lambda_handler(event, context):
     Returns:
         dict: Response with status and message
     """
-    print(f"Event received: {json.dumps(event)}")
+    if _DEBUG:
+        logger.debug("Event received: %s", event)
     
     try:
         record = event['Records'][0]
@@ -42,12 +96,25 @@ def lambda_handler(event, context):
         document_key = record['s3']['object']['key']
         file_size = record['s3']['object']['size']
         
-        print(f"Processing document: {document_key} ({file_size} bytes)")
+        # Reject inputs Textract would fail on before paying for the round-trip
+        extension = document_key.rsplit('.', 1)[-1].lower()
+        if extension not in SUPPORTED_EXTENSIONS or file_size == 0:
+            logger.info("Skipping unsupported or empty document: %s", document_key)
+            return {
+                'statusCode': 400,
+                'body': _dumps({'skipped': document_key})
+            }
         
-        document_id = generate_document_id(document_key)
-        upload_timestamp = datetime.utcnow().isoformat()
+        logger.info("Processing document: %s (%s bytes)", document_key, file_size)
         
-        db_handler.update_status(
+        uploaded_at = datetime.utcnow()
+        upload_timestamp = uploaded_at.isoformat()
+        document_id = generate_document_id(document_key, uploaded_at)
+        
+        # The status write runs alongside Textract; it is awaited before any
+        # later write for this document so the status updates stay ordered
+        status_future = _executor.submit(
+            db_handler.update_status,
             document_id=document_id,
             timestamp=upload_timestamp,
             status='processing',
@@ -59,14 +126,17 @@ def lambda_handler(event, context):
         )
         
         if file_size > 5 * 1024 * 1024:
-            return process_large_document(bucket, document_key, document_id, upload_timestamp)
+            return process_large_document(
+                bucket, document_key, document_id, upload_timestamp, status_future
+            )
         else:
-            return process_document_sync(bucket, document_key, document_id, upload_timestamp)
+            return process_document_sync(
+                bucket, document_key, document_id, upload_timestamp, status_future
+            )
             
     except Exception as e:
         error_message = f"Error processing document: {str(e)}"
-        print(error_message)
-        print(traceback.format_exc())
+        logger.exception(error_message)
         
         send_notification(
             subject="Document Processing Failed",
@@ -76,16 +146,21 @@ def lambda_handler(event, context):
         
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': error_message})
+            'body': _dumps({'error': error_message})
         }
 
 
-def process_document_sync(bucket, document_key, document_id, upload_timestamp):
+def process_document_sync(bucket, document_key, document_id, upload_timestamp,
+                          status_future=None):
     """
     Process document synchronously using Textract AnalyzeDocument.
     Used for documents under 5MB.
+    
+    status_future is the pending 'processing' status write, if any. It is
+    always allowed to finish before the final status is written, so it can
+    never overwrite 'completed' or 'failed'.
     """
-    print(f"Starting synchronous processing for {document_key}")
+    logger.info("Starting synchronous processing for %s", document_key)
     
     try:
         # Use S3 reference for synchronous processing (more efficient)
@@ -99,46 +174,137 @@ def process_document_sync(bucket, document_key, document_id, upload_timestamp):
             FeatureTypes=['FORMS', 'TABLES']
         )
         
-        print(f"Textract analysis completed. Blocks found: {len(response['Blocks'])}")
+        logger.info("Textract analysis completed. Blocks found: %d", len(response['Blocks']))
         
         extracted_data = parser.parse_response(response)
         
-        print(f"Extracted data: {json.dumps(extracted_data, default=str)[:500]}...")
+        if _DEBUG:
+            logger.debug(
+                "Extracted fields=%d tables=%d",
+                len(extracted_data.get('fields', {})),
+                len(extracted_data.get('tables', []))
+            )
+        
+        if status_future is not None:
+            status_future.result()
+        
+        return complete_document(bucket, document_key, document_id, upload_timestamp,
+                                 extracted_data)
+        
+    except Exception as e:
+        error_message = f"Error in synchronous processing: {str(e)}"
+        logger.error(error_message)
+        
+        if status_future is not None:
+            # Let the 'processing' write land first so 'failed' is not overwritten
+            wait([status_future])
         
-        db_handler.save_document(
+        db_handler.update_status(
             document_id=document_id,
             timestamp=upload_timestamp,
-            extracted_data=extracted_data,
-            source_bucket=bucket,
-            source_key=document_key,
-            status='completed'
+            status='failed',
+            error=error_message
         )
         
-        move_to_processed(bucket, document_key)
+        raise
+
+
+def complete_document(bucket, document_key, document_id, upload_timestamp, extracted_data):
+    """
+    Save extracted data, move the source document and notify about success.
+    Shared by the synchronous path and the async job completion handler.
+    
+    The document is only moved once its result is stored. The move (copy
+    and delete) then runs alongside the success notification and is
+    finished before this returns.
+    """
+    db_handler.save_document(
+        document_id=document_id,
+        timestamp=upload_timestamp,
+        extracted_data=extracted_data,
+        source_bucket=bucket,
+        source_key=document_key,
+        status='completed'
+    )
+    
+    move_future = _executor.submit(move_to_processed, bucket, document_key)
+    
+    send_notification(
+        subject="Document Processed Successfully",
+        message=f"Document {document_key} has been processed.\n"
+               f"Document ID: {document_id}\n"
+               f"Fields extracted: {len(extracted_data.get('fields', {}))}\n"
+               f"Tables found: {len(extracted_data.get('tables', []))}",
+        status="success",
+        document_id=document_id
+    )
+    
+    move_future.result()
+    
+    return {
+        'statusCode': 200,
+        'body': _dumps({
+            'message': 'Document processed successfully',
+            'document_id': document_id,
+            'fields_count': len(extracted_data.get('fields', {})),
+            'tables_count': len(extracted_data.get('tables', []))
+        })
+    }
+
+
+def process_large_document(bucket, document_key, document_id, upload_timestamp,
+                           status_future=None):
+    """
+    Process large documents asynchronously using Textract StartDocumentAnalysis.
+    Used for documents over 5MB.
+    
+    Starts the analysis job and returns right away instead of blocking the
+    Lambda on Textract. The upload timestamp is passed as the job tag, so
+    analysis_complete_handler can rebuild the document keys from the
+    completion message Textract publishes to TEXTRACT_TOPIC_ARN.
+    
+    The 'processing' status write is awaited before the job starts, so it
+    can never land after analysis_complete_handler has stored the result.
+    """
+    logger.info("Large document detected: %s", document_key)
+    
+    try:
+        if status_future is not None:
+            status_future.result()
         
-        send_notification(
-            subject="Document Processed Successfully",
-            message=f"Document {document_key} has been processed.\n"
-                   f"Document ID: {document_id}\n"
-                   f"Fields extracted: {len(extracted_data.get('fields', {}))}\n"
-                   f"Tables found: {len(extracted_data.get('tables', []))}",
-            status="success",
-            document_id=document_id
+        response = textract_client.start_document_analysis(
+            DocumentLocation={
+                'S3Object': {
+                    'Bucket': bucket,
+                    'Name': document_key
+                }
+            },
+            FeatureTypes=['FORMS', 'TABLES'],
+            JobTag=upload_timestamp,
+            NotificationChannel={
+                'SNSTopicArn': TEXTRACT_TOPIC_ARN,
+                'RoleArn': TEXTRACT_ROLE_ARN
+            }
         )
+        job_id = response['JobId']
+        
+        logger.info("Started Textract analysis job %s for %s", job_id, document_key)
         
         return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Document processed successfully',
+            'statusCode': 202,
+            'body': _dumps({
+                'message': 'Document analysis started',
                 'document_id': document_id,
-                'fields_count': len(extracted_data.get('fields', {})),
-                'tables_count': len(extracted_data.get('tables', []))
+                'job_id': job_id
             })
         }
         
     except Exception as e:
-        error_message = f"Error in synchronous processing: {str(e)}"
-        print(error_message)
+        error_message = f"Error starting asynchronous processing: {str(e)}"
+        logger.error(error_message)
+        
+        if status_future is not None:
+            wait([status_future])
         
         db_handler.update_status(
             document_id=document_id,
@@ -150,31 +316,116 @@ def process_document_sync(bucket, document_key, document_id, upload_timestamp):
         raise
 
 
-def process_large_document(bucket, document_key, document_id, upload_timestamp):
+def analysis_complete_handler(event, context):
     """
-    Process large documents asynchronously using Textract StartDocumentAnalysis.
-    Used for documents over 5MB.
+    Lambda handler for Textract job completion messages delivered over SNS.
+    
+    Errors are re-raised so that Lambda retries the event and finally sends
+    it to the dead letter queue. A job that Textract itself failed is not
+    retried.
     
-    Note: This requires additional setup for async processing.
-    For this tutorial, we'll keep it simple and process synchronously.
+    Args:
+        event: SNS event carrying the Textract completion message
+        context: Lambda context
+        
+    Returns:
+        dict: Response with status and message
     """
-    print(f"Large document detected: {document_key}")
+    try:
+        message = orjson.loads(event['Records'][0]['Sns']['Message'])
+        job_id = message['JobId']
+        bucket = message['DocumentLocation']['S3Bucket']
+        document_key = message['DocumentLocation']['S3ObjectName']
+        upload_timestamp = message['JobTag']
+        document_id = generate_document_id(
+            document_key, datetime.fromisoformat(upload_timestamp)
+        )
+        
+        logger.info("Textract job %s finished with status %s", job_id, message['Status'])
+        
+    except Exception as e:
+        error_message = f"Error handling Textract completion: {str(e)}"
+        logger.exception(error_message)
+        
+        send_notification(
+            subject="Document Processing Failed",
+            message=error_message,
+            status="error"
+        )
+        
+        raise
+    
+    if message['Status'] != 'SUCCEEDED':
+        error_message = f"Textract job {job_id} ended with status {message['Status']}"
+        logger.error(error_message)
+        fail_document(document_id, upload_timestamp, error_message)
+        
+        return {
+            'statusCode': 500,
+            'body': _dumps({'error': error_message})
+        }
     
-    return process_document_sync(bucket, document_key, document_id, upload_timestamp)
+    try:
+        extracted_data = parser.parse_response_incremental(get_analysis_pages(job_id))
+        
+        logger.info("Textract analysis completed. Blocks found: %d", extracted_data['block_count'])
+        
+        return complete_document(bucket, document_key, document_id, upload_timestamp,
+                                 extracted_data)
+        
+    except Exception as e:
+        error_message = f"Error processing document: {str(e)}"
+        logger.exception(error_message)
+        fail_document(document_id, upload_timestamp, error_message)
+        raise
 
 
-def generate_document_id(document_key):
+def fail_document(document_id, upload_timestamp, error_message):
+    """
+    Mark a document as failed and send the failure notification.
     """
-    Generate a unique document ID from the S3 key.
+    db_handler.update_status(
+        document_id=document_id,
+        timestamp=upload_timestamp,
+        status='failed',
+        error=error_message
+    )
+    
+    send_notification(
+        subject="Document Processing Failed",
+        message=error_message,
+        status="error",
+        document_id=document_id
+    )
+
+
+def get_analysis_pages(job_id):
     """
-    import hashlib
-    from datetime import datetime
+    Yield the result pages of a Textract document analysis job.
     
+    Textract has no paginator for GetDocumentAnalysis, so NextToken is
+    followed by hand. Pages are fetched lazily as the parser consumes them.
+    """
+    kwargs = {'JobId': job_id}
+    while True:
+        page = textract_client.get_document_analysis(**kwargs)
+        yield page
+        
+        next_token = page.get('NextToken')
+        if not next_token:
+            break
+        kwargs['NextToken'] = next_token
+
+
+def generate_document_id(document_key, uploaded_at):
+    """
+    Generate a unique document ID from the S3 key and upload time.
+    """
     filename = document_key.split('/')[-1].split('.')[0]
-    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    timestamp = uploaded_at.strftime('%Y%m%d%H%M%S')
     
     hash_input = f"{document_key}_{timestamp}"
-    hash_value = hashlib.md5(hash_input.encode()).hexdigest()[:8]
+    hash_value = hashlib.blake2b(hash_input.encode('utf-8'), digest_size=4).hexdigest()
     
     return f"{filename}_{timestamp}_{hash_value}"
 
@@ -194,10 +445,10 @@ def move_to_processed(bucket, document_key):
         
         s3_client.delete_object(Bucket=bucket, Key=document_key)
         
-        print(f"Moved document from {document_key} to {new_key}")
+        logger.info("Moved document from %s to %s", document_key, new_key)
         
     except Exception as e:
-        print(f"Warning: Could not move document: {str(e)}")
+        logger.warning("Could not move document: %s", e)
 
 
 def send_notification(subject, message, status, document_id=None):
@@ -218,24 +469,18 @@ def send_notification(subject, message, status, document_id=None):
         sns_client.publish(
             TopicArn=SNS_TOPIC_ARN,
             Subject=subject,
-            Message=json.dumps(notification_message, indent=2)
+            Message=_dumps(notification_message, option=orjson.OPT_INDENT_2)
         )
         
-        print(f"Notification sent: {subject}")
+        logger.info("Notification sent: %s", subject)
         
     except Exception as e:
-        print(f"Warning: Could not send notification: {str(e)}")
+        logger.warning("Could not send notification: %s", e)
 
 
-def convert_decimals(obj):
+def _dumps(obj, option=0):
     """
-    Convert Decimal objects to float for JSON serialization.
+    Serialize obj to a JSON string with orjson.
+    Values orjson cannot encode natively fall back to str().
     """
-    if isinstance(obj, list):
-        return [convert_decimals(i) for i in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_decimals(v) for k, v in obj.items()}
-    elif isinstance(obj, Decimal):
-        return float(obj)
-    else:
-        return obj
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | option).decode()
@@ -3,23 +3,79 @@ DynamoDB Handler
 Manages document data storage and retrieval
 """
 import boto3
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
 from datetime import datetime
 from decimal import Decimal
+import functools
 import json
+import logging
+import orjson
+import random
+import time
+import zstandard
+
+THROTTLING_ERROR_CODES = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+)
+
+# Resends of BatchWriteItem UnprocessedItems, which botocore does not retry
+MAX_UNPROCESSED_ATTEMPTS = 6
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_SIZE = 25
+
+ZSTD_LEVEL = 6
+
+logger = logging.getLogger(__name__)
+
+
+class ThrottlingException(Exception):
+    """Raised when DynamoDB keeps throttling a request after all retries."""
+
+
+def _raise_typed_throttling(func):
+    """
+    Turn a throttling error from a DynamoDB call into ThrottlingException.
+    
+    Retrying with backoff is left to the client's botocore retry config;
+    this only runs once those retries are exhausted, so callers such as
+    Step Functions can match on a typed exception and retry later.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in THROTTLING_ERROR_CODES:
+                raise
+            raise ThrottlingException(f"DynamoDB request throttled: {e}") from e
+    
+    return wrapper
 
 
 class DynamoDBHandler:
     """Handle DynamoDB operations for document storage."""
     
-    def __init__(self, table_name):
+    def __init__(self, table_name, config=None, compress_extracted_data=True):
         """
         Initialize DynamoDB handler.
         
         Args:
             table_name: Name of the DynamoDB table
+            config: Optional botocore Config for the DynamoDB client
+            compress_extracted_data: Store extracted data as zstd-compressed
+                JSON in extracted_data_zstd instead of a nested map
         """
-        self.dynamodb = boto3.resource('dynamodb')
-        self.table = self.dynamodb.Table(table_name)
+        # The low-level client skips the resource layer's per-call
+        # reflection; items are (de)serialized explicitly instead
+        self.client = boto3.client('dynamodb', config=config)
+        self.table_name = table_name
+        self.serializer = TypeSerializer()
+        self.deserializer = TypeDeserializer()
+        self.compress_extracted_data = compress_extracted_data
     
     def save_document(self, document_id, timestamp, extracted_data, 
                      source_bucket, source_key, status='completed'):
@@ -41,17 +97,58 @@ class DynamoDBHandler:
                 'status': status,
                 'source_bucket': source_bucket,
                 'source_key': source_key,
-                'processed_at': datetime.utcnow().isoformat(),
-                'extracted_data': self._convert_to_dynamo_format(extracted_data)
+                'processed_at': datetime.utcnow().isoformat()
             }
             
-            self.table.put_item(Item=item)
+            # Compressed JSON is far smaller than the nested map, which saves
+            # write capacity and keeps large documents under the 400KB item limit
+            if self.compress_extracted_data:
+                compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+                item['extracted_data_zstd'] = compressor.compress(
+                    orjson.dumps(extracted_data, default=str)
+                )
+            else:
+                item['extracted_data'] = self._convert_to_dynamo_format(extracted_data)
+            
+            _raise_typed_throttling(self.client.put_item)(
+                TableName=self.table_name,
+                Item=self._serialize_item(item)
+            )
+            
+            logger.info("Saved document %s to DynamoDB", document_id)
+            return True
+            
+        except Exception as e:
+            logger.error("Error saving to DynamoDB: %s", e)
+            raise
+    
+    def batch_save(self, items):
+        """
+        Save many items in as few requests as possible.
+        
+        Items are sent in BatchWriteItem calls of BATCH_WRITE_SIZE, later
+        items replacing earlier ones with the same key. Unprocessed items
+        are resent with exponential backoff.
+        
+        Args:
+            items: List of complete item dictionaries (including keys)
+        """
+        try:
+            put_requests = {}
+            for item in items:
+                item = self._convert_to_dynamo_format(item)
+                key = (item['document_id'], item['upload_timestamp'])
+                put_requests[key] = {'PutRequest': {'Item': self._serialize_item(item)}}
+            
+            put_requests = list(put_requests.values())
+            for start in range(0, len(put_requests), BATCH_WRITE_SIZE):
+                self._write_batch(put_requests[start:start + BATCH_WRITE_SIZE])
             
-            print(f"Saved document {document_id} to DynamoDB")
+            logger.info("Saved %d documents to DynamoDB", len(put_requests))
             return True
             
         except Exception as e:
-            print(f"Error saving to DynamoDB: {str(e)}")
+            logger.error("Error batch saving to DynamoDB: %s", e)
             raise
     
     def update_status(self, document_id, timestamp, status, metadata=None, error=None):
@@ -83,21 +180,22 @@ class DynamoDBHandler:
                 update_expression += ", error_message = :error"
                 expression_values[':error'] = error
             
-            self.table.update_item(
-                Key={
+            _raise_typed_throttling(self.client.update_item)(
+                TableName=self.table_name,
+                Key=self._serialize_item({
                     'document_id': document_id,
                     'upload_timestamp': timestamp
-                },
+                }),
                 UpdateExpression=update_expression,
                 ExpressionAttributeNames=expression_names,
-                ExpressionAttributeValues=expression_values
+                ExpressionAttributeValues=self._serialize_item(expression_values)
             )
             
-            print(f"Updated status for {document_id} to {status}")
+            logger.info("Updated status for %s to %s", document_id, status)
             return True
             
         except Exception as e:
-            print(f"Error updating status: {str(e)}")
+            logger.error("Error updating status: %s", e)
             raise
     
     def get_document(self, document_id, timestamp):
@@ -112,17 +210,19 @@ class DynamoDBHandler:
             dict: Document data or None if not found
         """
         try:
-            response = self.table.get_item(
-                Key={
+            response = _raise_typed_throttling(self.client.get_item)(
+                TableName=self.table_name,
+                Key=self._serialize_item({
                     'document_id': document_id,
                     'upload_timestamp': timestamp
-                }
+                })
             )
             
-            return response.get('Item')
+            item = response.get('Item')
+            return self._load_document(item) if item else None
             
-        except Exception as e:
-            print(f"Error retrieving document: {str(e)}")
+        except Exception:
+            logger.exception("Error retrieving document")
             return None
     
     def query_by_status(self, status, limit=10):
@@ -137,45 +237,115 @@ class DynamoDBHandler:
             list: List of documents
         """
         try:
-            response = self.table.query(
+            response = _raise_typed_throttling(self.client.query)(
+                TableName=self.table_name,
                 IndexName='status-index',
                 KeyConditionExpression='#status = :status',
                 ExpressionAttributeNames={'#status': 'status'},
-                ExpressionAttributeValues={':status': status},
+                ExpressionAttributeValues=self._serialize_item({':status': status}),
                 Limit=limit,
                 ScanIndexForward=False
             )
             
-            return response.get('Items', [])
+            return [self._load_document(item) for item in response.get('Items', [])]
             
-        except Exception as e:
-            print(f"Error querying by status: {str(e)}")
+        except Exception:
+            logger.exception("Error querying by status")
             return []
     
+    def _write_batch(self, put_requests):
+        """
+        Send one BatchWriteItem call and resend any unprocessed items.
+        """
+        pending = {self.table_name: put_requests}
+        for attempt in range(MAX_UNPROCESSED_ATTEMPTS):
+            response = _raise_typed_throttling(self.client.batch_write_item)(
+                RequestItems=pending
+            )
+            pending = response.get('UnprocessedItems')
+            if not pending:
+                return
+            if attempt < MAX_UNPROCESSED_ATTEMPTS - 1:
+                time.sleep(min(30, 0.5 * 2 ** attempt) + random.random() * 0.1)
+        
+        raise ThrottlingException(
+            f"DynamoDB left items unprocessed after {MAX_UNPROCESSED_ATTEMPTS} attempts"
+        )
+    
+    def _serialize_item(self, item):
+        """
+        Wrap each attribute in its DynamoDB type descriptor.
+        Values must already be in DynamoDB format (no floats).
+        """
+        return {key: self.serializer.serialize(value) for key, value in item.items()}
+    
+    def _deserialize_item(self, item):
+        """
+        Unwrap DynamoDB type descriptors back into Python values.
+        """
+        return {key: self.deserializer.deserialize(value) for key, value in item.items()}
+    
+    def _load_document(self, item):
+        """
+        Deserialize a document item, expanding compressed extracted data
+        back into the extracted_data key.
+        """
+        document = self._deserialize_item(item)
+        
+        compressed = document.pop('extracted_data_zstd', None)
+        if compressed is not None:
+            document['extracted_data'] = orjson.loads(
+                zstandard.ZstdDecompressor().decompress(compressed.value)
+            )
+        
+        return document
+    
     def _convert_to_dynamo_format(self, data):
         """
         Convert Python data types to DynamoDB-compatible format.
         Specifically handles float to Decimal conversion.
+        
+        Containers are updated in place and only the float leaves are
+        replaced, so the caller's object is returned rather than a copy.
         """
-        if isinstance(data, dict):
-            return {k: self._convert_to_dynamo_format(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self._convert_to_dynamo_format(item) for item in data]
-        elif isinstance(data, float):
-            return Decimal(str(data))
-        else:
-            return data
+        return self._convert_in_place(data, float, self._float_to_decimal)
     
     def _convert_from_dynamo_format(self, data):
         """
         Convert DynamoDB format back to Python types.
         Specifically handles Decimal to float conversion.
+        
+        Like _convert_to_dynamo_format, this mutates the given containers.
         """
-        if isinstance(data, dict):
-            return {k: self._convert_from_dynamo_format(v) for k, v in data.items()}
-        elif isinstance(data, list):
-            return [self._convert_from_dynamo_format(item) for item in data]
-        elif isinstance(data, Decimal):
-            return float(data)
-        else:
+        return self._convert_in_place(data, Decimal, float)
+    
+    @staticmethod
+    def _float_to_decimal(value):
+        # repr gives the shortest round-tripping form of the float
+        return Decimal(repr(value))
+    
+    @staticmethod
+    def _convert_in_place(data, source_type, convert):
+        """
+        Walk dicts and lists iteratively, replacing values of exactly
+        source_type with convert(value).
+        """
+        data_type = type(data)
+        if data_type is source_type:
+            return convert(data)
+        if data_type is not dict and data_type is not list:
             return data
+        
+        stack = [data]
+        while stack:
+            container = stack.pop()
+            keys = container.keys() if type(container) is dict else range(len(container))
+            for key in keys:
+                value = container[key]
+                value_type = type(value)
+                if value_type is source_type:
+                    container[key] = convert(value)
+                elif value_type is dict or value_type is list:
+                    stack.append(value)
+        
+        return data
@@ -1,13 +1,18 @@
 """
 Textract Response Parser
 Parses Amazon Textract responses into structured data
+
+Fully type-annotated so the Lambda build can compile it with mypyc.
 """
+from typing import Any, Iterable, Optional
+
+Block = dict[str, Any]
 
 
 class TextractParser:
     """Parse Textract responses into structured format."""
     
-    def parse_response(self, response):
+    def parse_response(self, response: dict[str, Any]) -> dict[str, Any]:
         """
         Parse Textract AnalyzeDocument response.
         
@@ -17,132 +22,198 @@ class TextractParser:
         Returns:
             dict: Structured data with fields, tables, and raw text
         """
-        blocks = response.get('Blocks', [])
+        return self.parse_response_incremental([response])
+    
+    def parse_response_incremental(self, responses: Iterable[dict[str, Any]]) -> dict[str, Any]:
+        """
+        Parse a sequence of Textract responses as one document.
         
-        blocks_map = {block['Id']: block for block in blocks}
+        Used for the result pages of GetDocumentAnalysis. Responses are
+        consumed one at a time and only the text of WORD and LINE blocks is
+        kept, so the bulk of each page can be released before the next one
+        arrives. KEY_VALUE_SET, TABLE, CELL and MERGED_CELL blocks are kept
+        until the end because their relationships may span pages; every
+        other block type (PAGE, SELECTION_ELEMENT, LAYOUT_*, ...) is dropped.
         
-        fields = self._extract_key_value_pairs(blocks, blocks_map)
-        tables = self._extract_tables(blocks, blocks_map)
-        raw_text = self._extract_raw_text(blocks)
+        Args:
+            responses: Iterable of Textract API responses
+            
+        Returns:
+            dict: Structured data with fields, tables, and raw text
+        """
+        # Single pass per page: index the form and table blocks by Id,
+        # collect KEY and TABLE blocks, and keep only text for WORD and LINE
+        blocks_map: dict[str, Block] = {}
+        key_blocks: list[Block] = []
+        value_of: dict[str, str] = {}
+        table_blocks: list[Block] = []
+        word_text: dict[str, str] = {}
+        text_lines: list[str] = []
+        block_count = 0
+        
+        for response in responses:
+            blocks: list[Block] = response.get('Blocks', [])
+            block_count += len(blocks)
+            
+            for block in blocks:
+                block_type = block['BlockType']
+                if block_type == 'WORD':
+                    word_text[block['Id']] = block.get('Text', '')
+                elif block_type == 'LINE':
+                    text_lines.append(block.get('Text', ''))
+                elif block_type == 'KEY_VALUE_SET':
+                    blocks_map[block['Id']] = block
+                    entity_types = block.get('EntityTypes')
+                    if entity_types is not None and 'KEY' in entity_types:
+                        key_blocks.append(block)
+                        for relationship in block.get('Relationships', ()):
+                            if relationship['Type'] == 'VALUE' and relationship['Ids']:
+                                value_of[block['Id']] = relationship['Ids'][0]
+                                break
+                elif block_type == 'TABLE':
+                    blocks_map[block['Id']] = block
+                    table_blocks.append(block)
+                elif block_type == 'CELL' or block_type == 'MERGED_CELL':
+                    blocks_map[block['Id']] = block
+        
+        text_cache: dict[str, str] = {}
+        
+        fields = self._extract_key_value_pairs(
+            key_blocks, value_of, blocks_map, word_text, text_cache
+        )
+        tables = self._extract_tables(table_blocks, blocks_map, word_text, text_cache)
+        raw_text = '\n'.join(text_lines)
         
         return {
             'fields': fields,
             'tables': tables,
             'raw_text': raw_text,
-            'block_count': len(blocks)
+            'block_count': block_count
         }
     
-    def _extract_key_value_pairs(self, blocks, blocks_map):
+    def _extract_key_value_pairs(self, key_blocks: list[Block], value_of: dict[str, str],
+                                 blocks_map: dict[str, Block], word_text: dict[str, str],
+                                 text_cache: dict[str, str]) -> dict[str, str]:
         """
-        Extract form fields (key-value pairs) from Textract response.
+        Extract form fields (key-value pairs) from KEY blocks.
+        
+        value_of maps each KEY block Id to the Id of its VALUE block.
         """
-        fields = {}
-        
-        for block in blocks:
-            if block['BlockType'] == 'KEY_VALUE_SET':
-                if 'KEY' in block.get('EntityTypes', []):
-                    key_text = self._get_text(block, blocks_map)
-                    value_block = self._find_value_block(block, blocks_map)
-                    
-                    if value_block:
-                        value_text = self._get_text(value_block, blocks_map)
-                        if key_text and value_text:
-                            fields[key_text] = value_text
+        fields: dict[str, str] = {}
+        
+        for block in key_blocks:
+            value_id = value_of.get(block['Id'])
+            value_block = blocks_map.get(value_id) if value_id is not None else None
+            
+            if value_block:
+                key_text = self._get_text(block, word_text, text_cache)
+                value_text = self._get_text(value_block, word_text, text_cache)
+                if key_text and value_text:
+                    fields[key_text] = value_text
         
         return fields
     
-    def _extract_tables(self, blocks, blocks_map):
+    def _extract_tables(self, table_blocks: list[Block], blocks_map: dict[str, Block],
+                        word_text: dict[str, str],
+                        text_cache: dict[str, str]) -> list[dict[str, Any]]:
         """
-        Extract tables from Textract response.
+        Extract tables from TABLE blocks.
         """
-        tables = []
+        tables: list[dict[str, Any]] = []
         
-        for block in blocks:
-            if block['BlockType'] == 'TABLE':
-                table = self._parse_table(block, blocks_map)
-                if table:
-                    tables.append(table)
+        for block in table_blocks:
+            table = self._parse_table(block, blocks_map, word_text, text_cache)
+            if table:
+                tables.append(table)
         
         return tables
     
-    def _parse_table(self, table_block, blocks_map):
+    def _parse_table(self, table_block: Block, blocks_map: dict[str, Block],
+                     word_text: dict[str, str],
+                     text_cache: dict[str, str]) -> Optional[dict[str, Any]]:
         """
         Parse a single table block into rows and columns.
-        """
-        rows = {}
         
+        Cells are written straight into a grid sized from the table's
+        RowCount/ColumnCount (or from the largest cell indices when those
+        are absent). MERGED_CELL text is copied into every position it spans.
+        """
         if 'Relationships' not in table_block:
             return None
         
+        cells: list[Block] = []
+        merged_cells: list[Block] = []
         for relationship in table_block['Relationships']:
             if relationship['Type'] == 'CHILD':
-                for cell_id in relationship['Ids']:
-                    cell = blocks_map.get(cell_id)
-                    if cell and cell['BlockType'] == 'CELL':
-                        row_index = cell.get('RowIndex', 0)
-                        col_index = cell.get('ColumnIndex', 0)
-                        
-                        if row_index not in rows:
-                            rows[row_index] = {}
-                        
-                        cell_text = self._get_text(cell, blocks_map)
-                        rows[row_index][col_index] = cell_text
-        
-        table_data = []
-        for row_index in sorted(rows.keys()):
-            row = rows[row_index]
-            row_data = [row.get(col_index, '') for col_index in sorted(row.keys())]
-            table_data.append(row_data)
+                target = cells
+            elif relationship['Type'] == 'MERGED_CELL':
+                target = merged_cells
+            else:
+                continue
+            for block_id in relationship['Ids']:
+                block = blocks_map.get(block_id)
+                if block and block.get('RowIndex') and block.get('ColumnIndex'):
+                    target.append(block)
+        
+        rows_n: int = table_block.get('RowCount') or 0
+        cols_n: int = table_block.get('ColumnCount') or 0
+        if not rows_n or not cols_n:
+            rows_n = max((cell['RowIndex'] for cell in cells), default=0)
+            cols_n = max((cell['ColumnIndex'] for cell in cells), default=0)
+        
+        table_data = [[''] * cols_n for _ in range(rows_n)]
+        
+        for cell in cells:
+            if cell['BlockType'] == 'CELL':
+                row_index = cell['RowIndex'] - 1
+                col_index = cell['ColumnIndex'] - 1
+                if row_index < rows_n and col_index < cols_n:
+                    cell_text = self._get_text(cell, word_text, text_cache)
+                    table_data[row_index][col_index] = cell_text
+        
+        for merged in merged_cells:
+            child_texts = [
+                self._get_text(blocks_map[child_id], word_text, text_cache)
+                for relationship in merged.get('Relationships', ())
+                if relationship['Type'] == 'CHILD'
+                for child_id in relationship['Ids']
+                if child_id in blocks_map
+            ]
+            merged_text = ' '.join(filter(None, child_texts))
+            row_start = merged['RowIndex'] - 1
+            col_start = merged['ColumnIndex'] - 1
+            row_end = min(row_start + merged.get('RowSpan', 1), rows_n)
+            col_end = min(col_start + merged.get('ColumnSpan', 1), cols_n)
+            for row in table_data[row_start:row_end]:
+                row[col_start:col_end] = [merged_text] * (col_end - col_start)
         
         return {
-            'rows': len(table_data),
-            'columns': len(table_data[0]) if table_data else 0,
+            'rows': rows_n,
+            'columns': cols_n,
             'data': table_data
         }
     
-    def _extract_raw_text(self, blocks):
-        """
-        Extract all raw text from LINE blocks.
-        """
-        text_lines = []
-        
-        for block in blocks:
-            if block['BlockType'] == 'LINE':
-                text_lines.append(block.get('Text', ''))
-        
-        return '\n'.join(text_lines)
-    
-    def _get_text(self, block, blocks_map):
-        """
-        Get text content from a block and its children.
+    def _get_text(self, block: Block, word_text: dict[str, str],
+                  text_cache: dict[str, str]) -> str:
         """
-        text = ''
+        Get text content from a block and its child WORD blocks.
         
-        if 'Text' in block:
-            text = block['Text']
-        
-        if 'Relationships' in block:
-            for relationship in block['Relationships']:
-                if relationship['Type'] == 'CHILD':
-                    for child_id in relationship['Ids']:
-                        child = blocks_map.get(child_id)
-                        if child and child['BlockType'] == 'WORD':
-                            text += child.get('Text', '') + ' '
-        
-        return text.strip()
-    
-    def _find_value_block(self, key_block, blocks_map):
-        """
-        Find the VALUE block associated with a KEY block.
+        Results are memoized in text_cache by block Id so that blocks
+        resolved more than once during a parse are only joined once.
         """
-        if 'Relationships' not in key_block:
-            return None
-        
-        for relationship in key_block['Relationships']:
-            if relationship['Type'] == 'VALUE':
-                for value_id in relationship['Ids']:
-                    value_block = blocks_map.get(value_id)
-                    if value_block:
-                        return value_block
-        
-        return None
+        block_id = block['Id']
+        if block_id in text_cache:
+            return text_cache[block_id]
+        
+        child_ids = [
+            child_id
+            for relationship in block.get('Relationships', ())
+            if relationship['Type'] == 'CHILD'
+            for child_id in relationship['Ids']
+        ]
+        parts: list[Optional[str]] = [block.get('Text')]
+        parts.extend(word_text.get(child_id) for child_id in child_ids)
+        
+        text = ' '.join(filter(None, parts)).strip()
+        text_cache[block_id] = text
+        return text